@@ -1,21 +1,69 @@
 import sys
 import numpy as np
-from math import log10
-import matplotlib.pyplot as plt
+from PIL import Image
 
 # UI Imports
 from PySide6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                                QHBoxLayout, QGroupBox, QPushButton, QLabel, 
                                QLineEdit, QRadioButton, QFileDialog, QFormLayout,
                                QFrame, QMessageBox, QScrollArea, QSizePolicy)
-from PySide6.QtCore import Qt
-from PySide6.QtGui import QAction, QIcon, QCursor
+from PySide6.QtCore import Qt, QLocale
+from PySide6.QtGui import QAction, QIcon, QCursor, QIntValidator, QDoubleValidator
 
 # Matplotlib Integration
 from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg as FigureCanvas
 # We are NOT importing NavigationToolbar anymore
 from matplotlib.figure import Figure
 
+# Optional JIT for the color search on big scans; plain NumPy is used without Numba
+try:
+    from numba import njit, prange, get_num_threads
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+JIT_MIN_PIXELS = 2_000_000
+
+if HAS_NUMBA:
+    @njit(parallel=True, cache=True)
+    def color_reduce(img_u8, r, g, b, tol2, sum_y, cnt, n_parts):
+        """Per-column sum of matching rows and hit count, in one pass over the image."""
+        H, W = img_u8.shape[0], img_u8.shape[1]
+        rows = (H + n_parts - 1) // n_parts
+        # Each thread reduces its own band of rows into a private buffer
+        part_sum = np.zeros((n_parts, W))
+        part_cnt = np.zeros((n_parts, W), dtype=np.int64)
+        for p in prange(n_parts):
+            for y in range(p * rows, min(H, (p + 1) * rows)):
+                for x in range(W):
+                    dr = np.int32(img_u8[y, x, 0]) - r
+                    dg = np.int32(img_u8[y, x, 1]) - g
+                    db = np.int32(img_u8[y, x, 2]) - b
+                    if dr * dr + dg * dg + db * db < tol2:
+                        part_sum[p, x] += y
+                        part_cnt[p, x] += 1
+        for p in range(n_parts):
+            sum_y += part_sum[p]
+            cnt += part_cnt[p]
+
+def thin_points(xs, ys, eps=0.5):
+    """Ramer-Douglas-Peucker: mask of the points needed to keep the polyline within eps pixels."""
+    if len(xs) < 3: return np.ones(len(xs), dtype=bool)
+    keep = np.zeros(len(xs), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(xs) - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2: continue
+        dx, dy = xs[j] - xs[i], ys[j] - ys[i]
+        dist = np.abs(dx * (ys[i + 1:j] - ys[i]) - dy * (xs[i + 1:j] - xs[i])) / np.hypot(dx, dy)
+        k = np.argmax(dist)
+        if dist[k] > eps:
+            k += i + 1
+            keep[k] = True
+            stack += [(i, k), (k, j)]
+    return keep
+
 class MplCanvas(FigureCanvas):
     """A canvas that integrates matplotlib into Qt."""
     def __init__(self, parent=None, width=5, height=4, dpi=100):
@@ -23,6 +71,8 @@ class MplCanvas(FigureCanvas):
         self.axes = self.fig.add_subplot(111)
         self.axes.axis('off')
         super().__init__(self.fig)
+        # Nothing listens for hover, so don't turn every mouse move into a matplotlib event
+        self.setMouseTracking(False)
 
 class CarbonTraceWindow(QMainWindow):
     def __init__(self):
@@ -32,14 +82,26 @@ class CarbonTraceWindow(QMainWindow):
 
         # -- Data State --
         self.img = None
+        self._img_u8 = None
+        self._img_packed = None
         self.calibration = {
             'x_min': {'pixel': None, 'val': None},
             'x_max': {'pixel': None, 'val': None},
             'y_min': {'pixel': None, 'val': None},
             'y_max': {'pixel': None, 'val': None}
         }
-        self.data_points = [] 
+        # Traced points as two growable arrays; only the first _n entries are valid
+        self._pts_x = np.empty(256)
+        self._pts_y = np.empty(256)
+        # Row kind: 0 manual pick, 1 auto-traced and drawn, 2 auto-traced but thinned from the plot
+        self._pts_kind = np.empty(256, dtype=np.uint8)
+        self._n = 0
         self.current_state = None 
+        self._bg = None
+
+        # -- Color State (parsed once per edit, mirrors the default field values) --
+        self._r, self._g, self._b = 0, 0, 0
+        self._tol = 0.10
 
         # -- UI Setup --
         self.init_ui()
@@ -94,6 +156,9 @@ class CarbonTraceWindow(QMainWindow):
         self.in_ymax = QLineEdit(""); self.in_ymax.setPlaceholderText("Value...")
         self.lbl_ymax_stat = QLabel("❌")
 
+        self._cal_stat = {'x_min': self.lbl_xmin_stat, 'x_max': self.lbl_xmax_stat,
+                          'y_min': self.lbl_ymin_stat, 'y_max': self.lbl_ymax_stat}
+
         # Connect buttons
         self.btn_xmin.clicked.connect(lambda: self.start_calibration('x_min'))
         self.btn_xmax.clicked.connect(lambda: self.start_calibration('x_max'))
@@ -139,6 +204,26 @@ class CarbonTraceWindow(QMainWindow):
         color_layout.addRow("G (0-255):", self.in_g)
         color_layout.addRow("B (0-255):", self.in_b)
         color_layout.addRow("Tol (%):", self.in_tol)
+
+        # Validators keep the fields parseable, so the values are cached as they're edited.
+        # C locale without group separators: only text int()/float() accept ("1,000" is not)
+        num_locale = QLocale.c()
+        num_locale.setNumberOptions(QLocale.RejectGroupSeparator)
+        for le in (self.in_r, self.in_g, self.in_b):
+            int_validator = QIntValidator(0, 255, self)
+            int_validator.setLocale(num_locale)
+            le.setValidator(int_validator)
+        tol_validator = QDoubleValidator(0.0, 200.0, 3, self)
+        tol_validator.setLocale(num_locale)
+        tol_validator.setNotation(QDoubleValidator.StandardNotation)
+        self.in_tol.setValidator(tol_validator)
+        self.in_r.editingFinished.connect(lambda: setattr(self, '_r', int(self.in_r.text())))
+        self.in_g.editingFinished.connect(lambda: setattr(self, '_g', int(self.in_g.text())))
+        self.in_b.editingFinished.connect(lambda: setattr(self, '_b', int(self.in_b.text())))
+        self.in_tol.editingFinished.connect(lambda: setattr(self, '_tol', float(self.in_tol.text()) / 100.0))
+        # Cleared or half-typed fields never finish editing, so drop the stale value
+        for le, attr in ((self.in_r, '_r'), (self.in_g, '_g'), (self.in_b, '_b'), (self.in_tol, '_tol')):
+            le.textChanged.connect(lambda _, a=attr: setattr(self, a, None))
         
         self.btn_clear = QPushButton("Clear Traces")
         self.btn_clear.clicked.connect(self.clear_points)
@@ -177,8 +262,11 @@ class CarbonTraceWindow(QMainWindow):
         
         plot_layout.addWidget(self.canvas)
         layout.addWidget(plot_container)
+        self.add_trace_line()
 
-        self.cid_click = self.canvas.mpl_connect('button_press_event', self.on_canvas_click)
+        # Click handler is only hooked up while calibrating or picking
+        self.cid_click = None
+        self.canvas.mpl_connect('draw_event', self.on_canvas_draw)
 
     def create_row(self, widget1, widget2):
         w = QWidget()
@@ -219,10 +307,33 @@ class CarbonTraceWindow(QMainWindow):
     def load_image(self):
         filename, _ = QFileDialog.getOpenFileName(self, "Open Graph", "", "Images (*.png *.jpg *.jpeg *.bmp)")
         if not filename: return
-        self.img = plt.imread(filename)
-        self.canvas.axes.clear()
-        self.canvas.axes.imshow(self.img)
-        self.canvas.axes.axis('off')
+        # Decode straight to uint8 RGB; the color search uses it as-is
+        with Image.open(filename) as im:
+            # 16-bit gray would be clipped at 255 by convert(), so scale it to 8 bits first
+            if im.mode in ('I', 'I;16', 'I;16B', 'I;16L', 'I;16N'):
+                im = Image.fromarray(((np.clip(np.asarray(im, dtype=np.int64), 0, 65535) + 128) // 257).astype(np.uint8))
+            # Transparent pixels go onto white, as the plot shows them; gray/palette expand to RGB
+            if im.mode in ('RGBA', 'LA', 'PA') or 'transparency' in im.info:
+                im = Image.alpha_composite(Image.new('RGBA', im.size, 'white'), im.convert('RGBA'))
+            self._img_u8 = np.asarray(im.convert('RGB'))
+        self.img = self._img_u8
+        self._img_packed = None
+
+        # Big scans are shown as a block-averaged copy of about screen size; the
+        # full-res array is kept for the color search
+        h, w = self._img_u8.shape[:2]
+        step = max(1, max(h, w) // 1200)
+        if step > 1:
+            h, w = h // step * step, w // step * step
+            blocks = self._img_u8[:h, :w].reshape(h // step, step, w // step, step, 3)
+            self._img_display = blocks.mean(axis=(1, 3)).astype(np.uint8)
+        else:
+            self._img_display = self._img_u8
+        # extent keeps the axes in full-res pixel coordinates, so clicks need no rescaling
+        self._img_extent = (-0.5, w - 0.5, h - 0.5, -0.5)
+
+        self.show_image()
+        self.add_trace_line()
         self.canvas.draw()
         self.lbl_hint.setText("Graph loaded. Please calibrate axes.")
 
@@ -231,6 +342,7 @@ class CarbonTraceWindow(QMainWindow):
             self.lbl_hint.setText("Please load an image first.")
             return
         self.current_state = key
+        self.connect_clicks()
         self.lbl_hint.setText(f"Click the location for {key}.")
         # Use Standard Arrow for calibration clicks
         self.canvas.setCursor(Qt.ArrowCursor)
@@ -238,14 +350,25 @@ class CarbonTraceWindow(QMainWindow):
     def toggle_picking(self):
         if self.btn_pick.isChecked():
             self.current_state = 'picking_points'
+            self.connect_clicks()
             self.lbl_hint.setText("Click to trace points. Right-click to undo.")
             # Set cursor to Cross immediately
             self.canvas.setCursor(Qt.CrossCursor)
         else:
             self.current_state = None
+            self.disconnect_clicks()
             self.lbl_hint.setText("Tracing paused.")
             self.canvas.setCursor(Qt.ArrowCursor)
 
+    def connect_clicks(self):
+        if self.cid_click is None:
+            self.cid_click = self.canvas.mpl_connect('button_press_event', self.on_canvas_click)
+
+    def disconnect_clicks(self):
+        if self.cid_click is not None:
+            self.canvas.mpl_disconnect(self.cid_click)
+            self.cid_click = None
+
     def on_canvas_click(self, event):
         if event.inaxes != self.canvas.axes: return
         
@@ -254,64 +377,153 @@ class CarbonTraceWindow(QMainWindow):
             if key.startswith('x'): self.calibration[key]['pixel'] = event.xdata
             else: self.calibration[key]['pixel'] = event.ydata
             
-            getattr(self, f"lbl_{key.replace('_','')}_stat").setText("✅")
+            self._cal_stat[key].setText("✅")
             self.lbl_hint.setText(f"{key} set. Input the value on the left.")
             
             self.canvas.axes.plot(event.xdata, event.ydata, 'x', color='#00E676', markersize=12, markeredgewidth=2)
-            self.canvas.draw()
+            self.canvas.draw_idle()
             self.current_state = None
+            self.disconnect_clicks()
             self.canvas.setCursor(Qt.ArrowCursor)
         
         elif self.current_state == 'picking_points':
             if event.button == 1: 
-                self.data_points.append((event.xdata, event.ydata))
-                self.canvas.axes.plot(event.xdata, event.ydata, '.', color='#00E676', markersize=8)
-                self.canvas.draw()
+                self.append_point(event.xdata, event.ydata)
+                self.update_trace_line()
                 # FIX: Force cursor back to crosshair after plot update
                 self.canvas.setCursor(Qt.CrossCursor)
             elif event.button == 3: 
-                if self.data_points:
-                    self.data_points.pop()
-                    self.redraw_plot()
+                if self._n:
+                    self._n -= 1
+                    if self._pts_kind[self._n]:
+                        # Auto-traced row: the overlay lives in the background, so redraw
+                        self._auto_line.set_data(*self.rows_of_kind(1))
+                        self.canvas.draw_idle()
+                    else:
+                        self.update_trace_line()
                     # FIX: Force cursor back to crosshair after undo
                     self.canvas.setCursor(Qt.CrossCursor)
 
     def select_by_color(self):
         if self.img is None: return
-        try:
-            r, g, b = int(self.in_r.text()), int(self.in_g.text()), int(self.in_b.text())
-            tol = float(self.in_tol.text()) / 100.0
-        except ValueError:
+        r, g, b, tol = self._r, self._g, self._b, self._tol
+        if None in (r, g, b, tol):
             self.lbl_hint.setText("Invalid color inputs.")
             return
 
-        target = np.array([r, g, b]) / 255.0
-        img_rgb = self.img[:, :, :3] 
-        dist = np.linalg.norm(img_rgb - target, axis=2)
-        y_idx, x_idx = np.where(dist < tol)
-        
-        unique_x = np.unique(x_idx)
-        new_points = []
-        for ux in unique_x:
-            uy = np.mean(y_idx[x_idx == ux])
-            new_points.append((ux, uy))
-        
-        self.data_points.extend(new_points)
-        x_plot = [p[0] for p in new_points]
-        y_plot = [p[1] for p in new_points]
-        self.canvas.axes.plot(x_plot, y_plot, '.', color='#00E676', markersize=2, alpha=0.5)
-        self.canvas.draw()
-        self.lbl_hint.setText(f"Auto-traced {len(new_points)} points.")
+        W = self._img_u8.shape[1]
+        exact = tol == 0 and 0 <= min(r, g, b) and max(r, g, b) <= 255
+        if HAS_NUMBA and not exact and self._img_u8.shape[0] * W >= JIT_MIN_PIXELS:
+            # Big scan: classify and column-reduce in one parallel pass, no mask array
+            sums, counts = np.zeros(W), np.zeros(W, dtype=np.int64)
+            color_reduce(self._img_u8, r, g, b, (max(tol, 0.0) * 255) ** 2, sums, counts,
+                          get_num_threads())
+            xs = np.nonzero(counts)[0]
+            ys = sums[xs] / counts[xs]
+        else:
+            if exact:
+                # Exact color: one uint32 compare per pixel on the packed 0xRRGGBB plane,
+                # built on the first exact search for this image
+                if self._img_packed is None:
+                    rgb = self._img_u8.astype(np.uint32)
+                    self._img_packed = (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+                y_idx, x_idx = np.nonzero(self._img_packed == (r << 16 | g << 8 | b))
+            else:
+                # Box test on the uint8 image first (same as cv2.inRange), then the
+                # exact squared-distance check in integers on the candidate pixels
+                tol255 = int(tol * 255)
+                target = np.array([r, g, b])
+                lower = np.clip(target - tol255, 0, 255).astype(np.uint8)
+                upper = np.clip(target + tol255, 0, 255).astype(np.uint8)
+                mask = np.all((self._img_u8 >= lower) & (self._img_u8 <= upper), axis=2)
+                y_idx, x_idx = np.nonzero(mask)
+
+                diff = self._img_u8[y_idx, x_idx].astype(np.int32) - target
+                dist2 = np.einsum('ij,ij->i', diff, diff)
+                hit = dist2 < (tol * 255) ** 2
+                y_idx, x_idx = y_idx[hit], x_idx[hit]
+
+            # Mean row per column in one pass: sum of rows / number of hits
+            if x_idx.size < W // 8:
+                # Sparse hits on a wide image: group over the hit columns only
+                # instead of zero-filling W-sized bins
+                xs, inv = np.unique(x_idx, return_inverse=True)
+                ys = np.bincount(inv, weights=y_idx) / np.bincount(inv)
+            else:
+                counts = np.bincount(x_idx, minlength=W)
+                sums = np.bincount(x_idx, weights=y_idx, minlength=W)
+                xs = np.nonzero(counts)[0]
+                ys = sums[xs] / counts[xs]
+
+        # Only the overlay is thinned: near-collinear runs are dropped from the plot
+        # (within half a pixel of the kept line), every column is still exported
+        keep = thin_points(xs, ys)
+        self.extend_points(xs, ys, np.where(keep, 1, 2))
+        self._auto_line.set_data(*self.rows_of_kind(1))
+        self.canvas.draw_idle()
+        self.lbl_hint.setText(f"Auto-traced {len(xs)} points.")
+
+    def append_point(self, x, y):
+        if self._n == len(self._pts_x): self._grow(self._n + 1)
+        self._pts_x[self._n] = x
+        self._pts_y[self._n] = y
+        self._pts_kind[self._n] = 0
+        self._n += 1
+
+    def extend_points(self, xs, ys, kinds):
+        end = self._n + len(xs)
+        if end > len(self._pts_x): self._grow(end)
+        self._pts_x[self._n:end] = xs
+        self._pts_y[self._n:end] = ys
+        self._pts_kind[self._n:end] = kinds
+        self._n = end
+
+    def rows_of_kind(self, kind):
+        m = self._pts_kind[:self._n] == kind
+        return self._pts_x[:self._n][m], self._pts_y[:self._n][m]
+
+    def _grow(self, needed):
+        # Double the capacity (or more, for a big auto-trace) so appends stay amortized O(1)
+        spare = max(needed, 2 * len(self._pts_x)) - self._n
+        self._pts_x = np.concatenate([self._pts_x[:self._n], np.empty(spare)])
+        self._pts_y = np.concatenate([self._pts_y[:self._n], np.empty(spare)])
+        self._pts_kind = np.concatenate([self._pts_kind[:self._n], np.empty(spare, dtype=np.uint8)])
+
+    def show_image(self):
+        self.canvas.axes.clear()
+        self.canvas.axes.imshow(self._img_display, extent=self._img_extent)
+        self.canvas.axes.axis('off')
+
+    def add_trace_line(self):
+        # One persistent artist for the manual picks; clicks only update its data.
+        # It is animated so full draws leave it out of the cached background.
+        self._trace_line, = self.canvas.axes.plot(*self.rows_of_kind(0), '.',
+                                                  color='#00E676', markersize=8, animated=True)
+        # Auto-traced rows are drawn small and RDP-thinned, as part of the background
+        self._auto_line, = self.canvas.axes.plot(*self.rows_of_kind(1), '.', color='#00E676', markersize=2)
+
+    def on_canvas_draw(self, event):
+        # Runs after every full draw (load, resize, calibration...): re-cache the background
+        self._bg = self.canvas.copy_from_bbox(self.canvas.axes.bbox)
+        self.canvas.axes.draw_artist(self._trace_line)
+
+    def update_trace_line(self):
+        self._trace_line.set_data(*self.rows_of_kind(0))
+        if self._bg is None:
+            self.canvas.draw_idle()
+            return
+        # Blit: paste the cached image back and draw only the markers on top
+        self.canvas.restore_region(self._bg)
+        self.canvas.axes.draw_artist(self._trace_line)
+        self.canvas.blit(self.canvas.axes.bbox)
 
     def clear_points(self):
-        self.data_points = []
+        self._n = 0
         self.redraw_plot()
 
     def redraw_plot(self):
         if self.img is None: return
-        self.canvas.axes.clear()
-        self.canvas.axes.imshow(self.img)
-        self.canvas.axes.axis('off')
+        self.show_image()
         
         for key, data in self.calibration.items():
             if data['pixel'] is not None:
@@ -319,17 +531,15 @@ class CarbonTraceWindow(QMainWindow):
                 if key.startswith('x'): self.canvas.axes.axvline(data['pixel'], color=color, linestyle='--', alpha=0.5)
                 else: self.canvas.axes.axhline(data['pixel'], color=color, linestyle='--', alpha=0.5)
 
-        if self.data_points:
-            xs, ys = zip(*self.data_points)
-            self.canvas.axes.plot(xs, ys, '.', color='#00E676', markersize=8)
-        self.canvas.draw()
+        self.add_trace_line()
+        self.canvas.draw_idle()
 
     def save_data(self):
         for key, data in self.calibration.items():
             if data['pixel'] is None:
                 QMessageBox.warning(self, "Calibration Error", f"Missing {key} location on the graph.")
                 return
-        if not self.data_points:
+        if not self._n:
             QMessageBox.warning(self, "Data Error", "No trace data points found.")
             return
 
@@ -347,7 +557,6 @@ class CarbonTraceWindow(QMainWindow):
             QMessageBox.warning(self, "Input Error", "Axes values must be valid numbers.")
             return
 
-        real_data = []
         x1_px, x2_px = cal['x_min']['pixel'], cal['x_max']['pixel']
         x1_val, x2_val = cal['x_min']['val'], cal['x_max']['val']
         y1_px, y2_px = cal['y_min']['pixel'], cal['y_max']['pixel']
@@ -355,24 +564,35 @@ class CarbonTraceWindow(QMainWindow):
 
         is_x_log, is_y_log = self.rad_x_log.isChecked(), self.rad_y_log.isChecked()
 
-        if is_x_log: x1_val, x2_val = log10(x1_val), log10(x2_val)
-        if is_y_log: y1_val, y2_val = log10(y1_val), log10(y2_val)
+        if (is_x_log and min(x1_val, x2_val) <= 0) or (is_y_log and min(y1_val, y2_val) <= 0):
+            QMessageBox.warning(self, "Input Error", "Log axes need positive limit values.")
+            return
+
+        px, py = self._pts_x[:self._n], self._pts_y[:self._n]
 
-        for px, py in self.data_points:
-            x_res = x1_val + (px - x1_px) * (x2_val - x1_val) / (x2_px - x1_px)
-            y_res = y1_val + (py - y1_px) * (y2_val - y1_val) / (y2_px - y1_px)
-            
-            if is_x_log: x_res = 10**x_res
-            if is_y_log: y_res = 10**y_res
-            real_data.append((x_res, y_res))
+        # Linear axes: value = offset + pixel * scale. Log axes interpolate
+        # geometrically, value = v1 * (v2 / v1) ** frac, with no log10/10** round trip.
+        if is_x_log:
+            x_res = x1_val * np.power(x2_val / x1_val, (px - x1_px) / (x2_px - x1_px))
+        else:
+            sx = (x2_val - x1_val) / (x2_px - x1_px)
+            x_res = (x1_val - x1_px * sx) + px * sx
+
+        if is_y_log:
+            y_res = y1_val * np.power(y2_val / y1_val, (py - y1_px) / (y2_px - y1_px))
+        else:
+            sy = (y2_val - y1_val) / (y2_px - y1_px)
+            y_res = (y1_val - y1_px * sy) + py * sy
 
         path, _ = QFileDialog.getSaveFileName(self, "Export Data - Enter Filename", "", "CSV Files (*.csv)")
         
         if path:
-            with open(path, 'w') as f:
+            # Format everything first so the file gets a single write; newline='' skips
+            # the per-character newline translation pass over the whole buffer
+            rows = "".join(f"{x},{y}\n" for x, y in zip(x_res.tolist(), y_res.tolist()))
+            with open(path, 'w', buffering=1 << 20, newline='') as f:
                 f.write("x,y\n")
-                for x, y in real_data:
-                    f.write(f"{x},{y}\n")
+                f.write(rows)
             self.lbl_hint.setText(f"Export successful: {path}")
 
 if __name__ == '__main__':
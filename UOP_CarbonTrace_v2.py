@@ -1,8 +1,7 @@
 import sys
 import numpy as np
-from math import log10
-import matplotlib.pyplot as plt
 import matplotlib as mpl
+from PIL import Image
 
 # --- FIX 1: Safely disable shortcuts (Prevents "keymap" crashes) ---
 keys_to_disable = ['keymap.yscale', 'keymap.xscale', 'keymap.all_axes']
@@ -17,13 +16,21 @@ from PySide6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
                                QHBoxLayout, QGroupBox, QPushButton, QLabel, 
                                QLineEdit, QRadioButton, QFileDialog, QFormLayout,
                                QFrame, QMessageBox, QScrollArea, QSizePolicy, QButtonGroup)
-from PySide6.QtCore import Qt
-from PySide6.QtGui import QAction, QIcon, QCursor
+from PySide6.QtCore import Qt, QLocale, QTimer
+from PySide6.QtGui import QAction, QIcon, QCursor, QIntValidator, QDoubleValidator
 
 # Matplotlib Integration
 from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
 
+# Most auto-traced markers drawn at once; the full set is still kept for export
+MAX_OVERLAY_POINTS = 5000
+# Scratch budget per row band in the color search (fits in L2 on typical CPUs)
+TILE_BYTES = 1 << 20
+# Rows formatted per savetxt call on export, bounding the temporary text
+SAVE_CHUNK_ROWS = 100_000
+
+
 class MplCanvas(FigureCanvas):
     """A canvas that integrates matplotlib into Qt."""
     def __init__(self, parent=None, width=5, height=4, dpi=100):
@@ -31,23 +38,34 @@ class MplCanvas(FigureCanvas):
         self.axes = self.fig.add_subplot(111)
         self.axes.axis('off')
         super().__init__(self.fig)
+        # Nothing listens for hover, so don't turn every mouse move into a matplotlib event
+        self.setMouseTracking(False)
 
 class CarbonTraceWindow(QMainWindow):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("UOP CarbonTrace - Graph Digitizer")
         self.resize(1200, 800)
-
         # -- Data State --
         self.img = None
+        self._cal_lines = {}
         self.calibration = {
             'x_min': {'pixel': None, 'val': None, 'name': 'X Min'},
             'x_max': {'pixel': None, 'val': None, 'name': 'X Max'},
             'y_min': {'pixel': None, 'val': None, 'name': 'Y Min'},
             'y_max': {'pixel': None, 'val': None, 'name': 'Y Max'}
         }
-        self.data_points = [] 
+        # Traced points: rows [0, _n) of a capacity-doubled (cap, 2) float64 buffer
+        self._pts_cap = 1024
+        self._pts = np.empty((self._pts_cap, 2), dtype=np.float64)
+        # True for auto-traced rows: drawn by the thinned overlay, not the pick markers
+        self._pts_auto = np.zeros(self._pts_cap, dtype=bool)
+        self._n = 0
+        self._r, self._g, self._b = 0, 0, 0
+        self._tol = 0.10
         self.current_state = None 
+        self._bg = None
+        self._draw_pending = False
 
         # -- Scale State --
         self.x_scale_type = 'linear'
@@ -116,6 +134,18 @@ class CarbonTraceWindow(QMainWindow):
         l_cal.addRow(self.btn_ymin, self.create_row(self.in_ymin, self.lbl_ymin_stat))
         l_cal.addRow(self.btn_ymax, self.create_row(self.in_ymax, self.lbl_ymax_stat))
 
+        # Axis values are parsed once per edit into calibration[key]['val'].
+        # C locale without group separators: only text int()/float() accept ("1,000" is not)
+        num_locale = QLocale.c()
+        num_locale.setNumberOptions(QLocale.RejectGroupSeparator)
+        val_validator = QDoubleValidator(self)
+        val_validator.setLocale(num_locale)
+        for key in self.calibration:
+            le = getattr(self, f"in_{key.replace('_','')}")
+            le.setValidator(val_validator)
+            le.textChanged.connect(lambda _, k=key: self.calibration[k].update(val=None))
+            le.editingFinished.connect(lambda k=key, le=le: self.calibration[k].update(val=float(le.text())))
+
         # --- FIX 2: Strict Button Groups (Prevents "Disappearing Dot") ---
         # We group the radio buttons so one MUST always be active.
         
@@ -166,6 +196,23 @@ class CarbonTraceWindow(QMainWindow):
         color_layout.addRow("G (0-255):", self.in_g)
         color_layout.addRow("B (0-255):", self.in_b)
         color_layout.addRow("Tol (%):", self.in_tol)
+
+        # Validators keep the fields parseable, so the values are cached as they're edited
+        for le in (self.in_r, self.in_g, self.in_b):
+            int_validator = QIntValidator(0, 255, self)
+            int_validator.setLocale(num_locale)
+            le.setValidator(int_validator)
+        tol_validator = QDoubleValidator(0.0, 200.0, 3, self)
+        tol_validator.setLocale(num_locale)
+        tol_validator.setNotation(QDoubleValidator.StandardNotation)
+        self.in_tol.setValidator(tol_validator)
+        self.in_r.editingFinished.connect(lambda: setattr(self, '_r', int(self.in_r.text())))
+        self.in_g.editingFinished.connect(lambda: setattr(self, '_g', int(self.in_g.text())))
+        self.in_b.editingFinished.connect(lambda: setattr(self, '_b', int(self.in_b.text())))
+        self.in_tol.editingFinished.connect(lambda: setattr(self, '_tol', float(self.in_tol.text()) / 100.0))
+        # Cleared or half-typed fields never finish editing, so drop the stale value
+        for le, attr in ((self.in_r, '_r'), (self.in_g, '_g'), (self.in_b, '_b'), (self.in_tol, '_tol')):
+            le.textChanged.connect(lambda _, a=attr: setattr(self, a, None))
         
         self.btn_clear = QPushButton("Clear Traces")
         self.btn_clear.clicked.connect(self.clear_points)
@@ -204,6 +251,8 @@ class CarbonTraceWindow(QMainWindow):
         layout.addWidget(plot_container)
 
         self.cid_click = self.canvas.mpl_connect('button_press_event', self.on_canvas_click)
+        self.canvas.mpl_connect('draw_event', self.on_canvas_draw)
+        self.create_artists()
 
     def create_row(self, widget1, widget2):
         w = QWidget()
@@ -255,10 +304,22 @@ class CarbonTraceWindow(QMainWindow):
     def load_image(self):
         filename, _ = QFileDialog.getOpenFileName(self, "Open Graph", "", "Images (*.png *.jpg *.jpeg *.bmp)")
         if not filename: return
-        self.img = plt.imread(filename)
+        # uint8 RGB straight from the decoder (plt.imread gave 0-1 floats for PNG)
+        with Image.open(filename) as im:
+            # 16-bit gray would be clipped at 255 by convert(), so scale it to 8 bits first
+            if im.mode in ('I', 'I;16', 'I;16B', 'I;16L', 'I;16N'):
+                im = Image.fromarray(((np.clip(np.asarray(im, dtype=np.int64), 0, 65535) + 128) // 257).astype(np.uint8))
+            # Transparent pixels go onto white, as the plot shows them; gray/palette expand to RGB
+            if im.mode in ('RGBA', 'LA', 'PA') or 'transparency' in im.info:
+                im = Image.alpha_composite(Image.new('RGBA', im.size, 'white'), im.convert('RGBA'))
+            self.img = np.ascontiguousarray(im.convert('RGB'))
         self.canvas.axes.clear()
+        # The image is drawn once per load; redraw_plot only touches the overlays
         self.canvas.axes.imshow(self.img)
         self.canvas.axes.axis('off')
+        self._cal_lines = {}
+        self.create_artists()
+        # The one synchronous draw: it fills the blit background for the new image
         self.canvas.draw()
         self.lbl_hint.setText("Graph loaded. Please calibrate axes.")
 
@@ -291,70 +352,156 @@ class CarbonTraceWindow(QMainWindow):
             getattr(self, f"lbl_{key.replace('_','')}_stat").setText("✅")
             self.lbl_hint.setText(f"{key} set. Input the value on the left.")
             
-            self.canvas.axes.plot(event.xdata, event.ydata, 'x', color='#00E676', markersize=12, markeredgewidth=2)
-            self.canvas.draw()
+            xs, ys = self._cal_artist.get_data()
+            self._cal_artist.set_data(np.append(xs, event.xdata), np.append(ys, event.ydata))
+            self._schedule_draw()
             self.current_state = None
             self.canvas.setCursor(Qt.ArrowCursor)
         
         elif self.current_state == 'picking_points':
             if event.button == 1: 
-                self.data_points.append((event.xdata, event.ydata))
-                self.canvas.axes.plot(event.xdata, event.ydata, '.', color='#00E676', markersize=8)
-                self.canvas.draw()
+                self._append(event.xdata, event.ydata)
+                self.blit_points()
                 self.canvas.setCursor(Qt.CrossCursor)
             elif event.button == 3: 
-                if self.data_points:
-                    self.data_points.pop()
-                    self.redraw_plot()
+                if self._n:
+                    self._n -= 1
+                    if self._pts_auto[self._n]:
+                        # The overlay is part of the cached background, so it needs a draw
+                        self._trace_coll.set_offsets(self._auto_pts())
+                        self._schedule_draw()
+                    else:
+                        self.blit_points()
                     self.canvas.setCursor(Qt.CrossCursor)
 
     def select_by_color(self):
         if self.img is None: return
-        try:
-            r, g, b = int(self.in_r.text()), int(self.in_g.text()), int(self.in_b.text())
-            tol = float(self.in_tol.text()) / 100.0
-        except ValueError:
+        r, g, b, tol = self._r, self._g, self._b, self._tol
+        if None in (r, g, b, tol):
             self.lbl_hint.setText("Invalid color inputs.")
             return
 
-        target = np.array([r, g, b]) / 255.0
-        img_rgb = self.img[:, :, :3] 
-        dist = np.linalg.norm(img_rgb - target, axis=2)
-        y_idx, x_idx = np.where(dist < tol)
-        
-        unique_x = np.unique(x_idx)
-        new_points = []
-        for ux in unique_x:
-            uy = np.mean(y_idx[x_idx == ux])
-            new_points.append((ux, uy))
-        
-        self.data_points.extend(new_points)
-        x_plot = [p[0] for p in new_points]
-        y_plot = [p[1] for p in new_points]
-        self.canvas.axes.plot(x_plot, y_plot, '.', color='#00E676', markersize=2, alpha=0.5)
-        self.canvas.draw()
-        self.lbl_hint.setText(f"Auto-traced {len(new_points)} points.")
+        # Squared integer distance against (tol * 255)**2: no sqrt, no floats.
+        # A pixel within tol is within tol on every channel, so three 256-entry
+        # tables give a cheap superset; the exact test then runs on those only.
+        img_rgb = self.img
+        target = np.array([r, g, b], dtype=np.int32)
+        thr2 = (tol * 255.0) ** 2
+        levels = np.arange(256)
+        lut_r, lut_g, lut_b = (np.abs(levels - c) < tol * 255.0 for c in (r, g, b))
+
+        # Walk the image in row bands so the scratch arrays stay cache-sized
+        H, W = img_rgb.shape[:2]
+        rows = max(1, TILE_BYTES // (W * 3))
+        ys, xs = [], []
+        for y0 in range(0, H, rows):
+            band = img_rgb[y0:y0 + rows]
+            yy, xx = np.nonzero(lut_r[band[..., 0]] & lut_g[band[..., 1]] & lut_b[band[..., 2]])
+            diff = band[yy, xx].astype(np.int32) - target
+            hit = np.einsum('ij,ij->i', diff, diff) < thr2
+            ys.append(yy[hit] + y0)
+            xs.append(xx[hit])
+        y_idx, x_idx = np.concatenate(ys), np.concatenate(xs)
+
+        # Mean row of the hits in each column: bincount sums / bincount counts
+        x_idx = x_idx.astype(np.int64)
+        counts = np.bincount(x_idx, minlength=W)
+        sums = np.bincount(x_idx, weights=y_idx.astype(np.float64), minlength=W)
+        cols = np.nonzero(counts)[0]
+        uy = sums[cols] / counts[cols]
+
+        self._extend(cols, uy, auto=True)
+        self._trace_coll.set_offsets(self._auto_pts())
+        self.canvas.draw_idle()
+        self.lbl_hint.setText(f"Auto-traced {len(cols)} points.")
+
+    # -- Point Buffer --
+    def _reserve(self, n):
+        if n > self._pts_cap:
+            while self._pts_cap < n: self._pts_cap *= 2
+            self._pts = np.resize(self._pts, (self._pts_cap, 2))
+            self._pts_auto = np.resize(self._pts_auto, self._pts_cap)
+
+    def _append(self, x, y):
+        self._reserve(self._n + 1)
+        self._pts[self._n] = (x, y)
+        self._pts_auto[self._n] = False
+        self._n += 1
+
+    def _extend(self, xs, ys, auto):
+        end = self._n + len(xs)
+        self._reserve(end)
+        self._pts[self._n:end, 0] = xs
+        self._pts[self._n:end, 1] = ys
+        self._pts_auto[self._n:end] = auto
+        self._n = end
+
+    def _manual_pts(self):
+        return self._pts[:self._n][~self._pts_auto[:self._n]]
+
+    def _auto_pts(self):
+        # Agg cost grows with marker count, so auto-traced rows are drawn as an even
+        # subsample of at most MAX_OVERLAY_POINTS; export still uses every row
+        auto = self._pts[:self._n][self._pts_auto[:self._n]]
+        return auto[::max(1, -(-len(auto) // MAX_OVERLAY_POINTS))]
+
+    # -- Artists & Blitting --
+    def create_artists(self):
+        # One artist per role, fed with set_data; the axes never grow per click
+        ax = self.canvas.axes
+        self._cal_artist, = ax.plot([], [], 'x', color='#00E676', markersize=12, markeredgewidth=2)
+        # Point sets are PathCollections: Agg stamps one marker path at every offset
+        self._trace_coll = ax.scatter(np.empty(0), np.empty(0), s=4, c='#00E676', linewidths=0, alpha=0.5)
+        self._trace_coll.set_offsets(self._auto_pts())
+        # Manual picks are animated, kept out of the cached background
+        self._pts_coll = ax.scatter(np.empty(0), np.empty(0), s=32, c='#00E676', linewidths=0, animated=True)
+        self._pts_coll.set_offsets(self._manual_pts())
+
+    def on_canvas_draw(self, event):
+        # Every full draw (load, resize, calibration, redraw) refreshes the background
+        self._bg = self.canvas.copy_from_bbox(self.canvas.axes.bbox)
+        self.canvas.axes.draw_artist(self._pts_coll)
+
+    def blit_points(self):
+        self._pts_coll.set_offsets(self._manual_pts())
+        if self._bg is None:
+            self._schedule_draw()
+            return
+        self.canvas.restore_region(self._bg)
+        self.canvas.axes.draw_artist(self._pts_coll)
+        self.canvas.blit(self.canvas.axes.bbox)
+
+    def _schedule_draw(self):
+        # Click bursts share one redraw per ~60 Hz frame
+        if self._draw_pending: return
+        self._draw_pending = True
+        QTimer.singleShot(16, self._do_draw)
+
+    def _do_draw(self):
+        self._draw_pending = False
+        self.canvas.draw_idle()
 
     def clear_points(self):
-        self.data_points = []
+        self._n = 0
         self.redraw_plot()
 
     def redraw_plot(self):
         if self.img is None: return
-        self.canvas.axes.clear()
-        self.canvas.axes.imshow(self.img)
-        self.canvas.axes.axis('off')
+        self._cal_artist.set_data([], [])
+        self._trace_coll.set_offsets(self._auto_pts())
+        self._pts_coll.set_offsets(self._manual_pts())
         
         for key, data in self.calibration.items():
             if data['pixel'] is not None:
+                p, line = data['pixel'], self._cal_lines.get(key)
                 color = '#00E676'
-                if key.startswith('x'): self.canvas.axes.axvline(data['pixel'], color=color, linestyle='--', alpha=0.5)
-                else: self.canvas.axes.axhline(data['pixel'], color=color, linestyle='--', alpha=0.5)
+                if line is not None:
+                    if key.startswith('x'): line.set_xdata([p, p])
+                    else: line.set_ydata([p, p])
+                elif key.startswith('x'): self._cal_lines[key] = self.canvas.axes.axvline(p, color=color, linestyle='--', alpha=0.5)
+                else: self._cal_lines[key] = self.canvas.axes.axhline(p, color=color, linestyle='--', alpha=0.5)
 
-        if self.data_points:
-            xs, ys = zip(*self.data_points)
-            self.canvas.axes.plot(xs, ys, '.', color='#00E676', markersize=8)
-        self.canvas.draw()
+        self.canvas.draw_idle()
 
     def save_data(self):
         # Validation
@@ -368,51 +515,45 @@ class CarbonTraceWindow(QMainWindow):
             QMessageBox.warning(self, "Calibration Missing", msg)
             return
 
-        if not self.data_points:
+        if not self._n:
             QMessageBox.warning(self, "Data Error", "No trace data points found.")
             return
 
-        try:
-            if not self.in_xmin.text() or not self.in_xmax.text() or not self.in_ymin.text() or not self.in_ymax.text():
-                 QMessageBox.warning(self, "Input Error", "Please enter values for all 4 axes limits.")
-                 return
-
-            cal = self.calibration
-            cal['x_min']['val'] = float(self.in_xmin.text())
-            cal['x_max']['val'] = float(self.in_xmax.text())
-            cal['y_min']['val'] = float(self.in_ymin.text())
-            cal['y_max']['val'] = float(self.in_ymax.text())
-        except ValueError:
-            QMessageBox.warning(self, "Input Error", "Axes values must be valid numbers.")
+        cal = self.calibration
+        if any(data['val'] is None for data in cal.values()):
+            QMessageBox.warning(self, "Input Error", "Please enter values for all 4 axes limits.")
             return
 
-        real_data = []
         x1_px, x2_px = cal['x_min']['pixel'], cal['x_max']['pixel']
         x1_val, x2_val = cal['x_min']['val'], cal['x_max']['val']
         y1_px, y2_px = cal['y_min']['pixel'], cal['y_max']['pixel']
         y1_val, y2_val = cal['y_min']['val'], cal['y_max']['val']
 
-        if self.x_scale_type == 'log':
-            x1_val, x2_val = log10(x1_val), log10(x2_val)
-        
-        if self.y_scale_type == 'log':
-            y1_val, y2_val = log10(y1_val), log10(y2_val)
+        x_log, y_log = self.x_scale_type == 'log', self.y_scale_type == 'log'
+        if (x_log and min(x1_val, x2_val) <= 0) or (y_log and min(y1_val, y2_val) <= 0):
+            QMessageBox.warning(self, "Input Error", "Log axes need positive limit values.")
+            return
 
-        for px, py in self.data_points:
-            x_res = x1_val + (px - x1_px) * (x2_val - x1_val) / (x2_px - x1_px)
-            y_res = y1_val + (py - y1_px) * (y2_val - y1_val) / (y2_px - y1_px)
-            
-            if self.x_scale_type == 'log': x_res = 10**x_res
-            if self.y_scale_type == 'log': y_res = 10**y_res
-            real_data.append((x_res, y_res))
+        # Log axes interpolate geometrically, v1 * (v2 / v1) ** frac: one power per
+        # point and no log10/10** pair, exact at the calibration marks
+        x_span = x2_val / x1_val if x_log else x2_val - x1_val
+        y_span = y2_val / y1_val if y_log else y2_val - y1_val
+        x_inv, y_inv = 1.0 / (x2_px - x1_px), 1.0 / (y2_px - y1_px)
+        pts = self._pts[:self._n]
+
+        x_frac = (pts[:, 0] - x1_px) * x_inv
+        y_frac = (pts[:, 1] - y1_px) * y_inv
+        x_res = x1_val * np.power(x_span, x_frac) if x_log else x1_val + x_frac * x_span
+        y_res = y1_val * np.power(y_span, y_frac) if y_log else y1_val + y_frac * y_span
+        out = np.column_stack([x_res, y_res])
 
         path, _ = QFileDialog.getSaveFileName(self, "Export Data - Enter Filename", "", "CSV Files (*.csv)")
         
         if path:
-            with open(path, 'w') as f:
-                f.write("x,y\n")
-                for x, y in real_data:
-                    f.write(f"{x},{y}\n")
+            with open(path, 'w', newline='', buffering=1 << 20) as f:
+                f.write('x,y\n')
+                for i in range(0, len(out), SAVE_CHUNK_ROWS):
+                    np.savetxt(f, out[i:i + SAVE_CHUNK_ROWS], fmt='%.17g', delimiter=',')
             self.lbl_hint.setText(f"Export successful: {path}")
 
 if __name__ == '__main__':